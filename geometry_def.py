@@ -2,10 +2,9 @@
 This script contain the definition of geometrical objects needed to build the geometry.
 """
 
-from operator import attrgetter
+from dataclasses import dataclass
 import gmsh
 import numpy as np
-import math
 
 
 class Point:
@@ -27,6 +26,8 @@ class Point:
             at that point
     """
 
+    __slots__ = ('x', 'y', 'z', 'mesh_size', 'dim', 'tag')
+
     def __init__(self, x, y, mesh_size):
 
         self.x = x
@@ -87,6 +88,8 @@ class Line:
         second point of the line
     """
 
+    __slots__ = ('start_point', 'end_point', 'dim', 'tag')
+
     def __init__(self, start_point, end_point):
         self.start_point = start_point
         self.end_point = end_point
@@ -129,6 +132,59 @@ class Line:
         """
         gmsh.model.occ.translate([(self.dim, self.tag)], *vector)
 
+
+class Curve:
+    """
+    A class to represent a curve of gmsh already created by another
+    geometrical primitive (e.g. one side of an OCC rectangle)
+
+    ...
+
+    Attributes
+    ----------
+    tag : int
+        tag of the existing gmsh curve
+    """
+
+    __slots__ = ('dim', 'tag')
+
+    def __init__(self, tag):
+        self.dim = 1
+        self.tag = tag
+
+    def rotation(self, angle, origin, axis):
+        """
+        Methode to rotate the object Curve
+        ...
+
+        Parameters
+        ----------
+        angle : float
+            angle of rotation in rad
+        origin : tuple
+            tuple of point (x,y,z) which is the origin of the rotation
+        axis : tuple
+            tuple of point (x,y,z) which represent the axis of rotation
+        """
+        gmsh.model.occ.rotate(
+            [(self.dim, self.tag)],
+            *origin,
+            *axis,
+            angle,
+        )
+
+    def translation(self, vector):
+        """
+        Methode to translate the object Curve
+        ...
+
+        Parameters
+        ----------
+        direction : tuple
+            tuple of point (x,y,z) which represent the direction of the translation
+        """
+        gmsh.model.occ.translate([(self.dim, self.tag)], *vector)
+
 class CurveLoop:
     """
     A class to represent the CurveLoop geometrical object of gmsh
@@ -143,6 +199,8 @@ class CurveLoop:
         List of Line object, in the order of the wanted CurveLoop and closed
     """
 
+    __slots__ = ('line_list', 'dim', 'tag_list', 'tag')
+
     def __init__(self, line_list):
 
         self.line_list = line_list
@@ -175,6 +233,11 @@ class Circle:
         resulting circle will be composed of
     """
 
+    __slots__ = (
+        'xc', 'yc', 'zc', 'radius', 'mesh_size', 'dim', 'distribution',
+        'arcCircle_list', '_loop_tag', 'bc', 'physical_name',
+    )
+
     def __init__(self, xc, yc, diameter, n_points):
         # Position of the disk center
         self.xc = xc
@@ -187,20 +250,47 @@ class Circle:
 
         # create a structured arcCricle to merge in one curveloop
         self.distribution = int(n_points*np.pi)
+        # plain floats, no NumPy scalar is built nor converted at each addCircle call
+        angles = np.linspace(0, 2 * np.pi, self.distribution + 1).tolist()
+        add_circle = gmsh.model.occ.addCircle
         self.arcCircle_list = [
-            gmsh.model.occ.addCircle(
+            add_circle(
                 self.xc,
                 self.yc,
                 self.zc,
                 self.radius,
-                angle1=2 * np.pi / self.distribution * i,
-                angle2=2 * np.pi / self.distribution * (1 + i),
+                angle1=angle1,
+                angle2=angle2,
             )
-            for i in range(0, self.distribution)
+            for angle1, angle2 in zip(angles[:-1], angles[1:])
         ]
-        # Remove the duplicated points generated by the arcCircle
-        gmsh.model.occ.synchronize()
-        gmsh.model.occ.removeAllDuplicates()
+        self._loop_tag = None
+        # The duplicated points generated by the arcCircle have to be removed
+        # once the whole geometry is defined (gmsh.model.occ.removeAllDuplicates)
+
+    @classmethod
+    def add_many(cls, positions, diameter, n_points):
+        """
+        Method to create all the circles of the same diameter in one pass
+        ...
+
+        Parameters
+        ----------
+        positions : array_like
+            (N, 2) positions (x, y) of the centers
+        diameter : float
+            diameter of the circles
+        n_points : int
+            given to each Circle
+
+        Returns
+        -------
+        circles : list(Circle)
+            circles in the order of positions
+        """
+        centers = np.asarray(positions, dtype=np.float64).reshape(-1, 2).tolist()
+        # No synchronization here, it is done once the whole geometry is defined
+        return [cls(xc, yc, diameter, n_points) for xc, yc in centers]
 
     def close_loop(self):
         """
@@ -211,7 +301,10 @@ class Circle:
         _ : int
             return the tag of the CurveLoop object
         """
-        return gmsh.model.occ.addCurveLoop(self.arcCircle_list)
+        # The CurveLoop is only created once, even if used by several surfaces
+        if self._loop_tag is None:
+            self._loop_tag = gmsh.model.occ.addCurveLoop(self.arcCircle_list)
+        return self._loop_tag
 
     def define_bc(self, name):
         """
@@ -223,6 +316,32 @@ class Circle:
         self.bc = gmsh.model.addPhysicalGroup(self.dim, self.arcCircle_list)
         self.physical_name = gmsh.model.setPhysicalName(self.dim, self.bc, name)
 
+    @staticmethod
+    def define_bc_batch(circles, name):
+        """
+        Method that define a single marker for all the given circles
+        for the boundary condition
+        ...
+
+        Parameters
+        ----------
+        circles : list(Circle)
+            circles sharing the boundary condition
+        name : str
+            name of the physical group
+
+        Returns
+        -------
+        bc : int
+            tag of the physical group
+        """
+        arcs = [arccircle for circle in circles for arccircle in circle.arcCircle_list]
+        bc = gmsh.model.addPhysicalGroup(1, arcs)
+        gmsh.model.setPhysicalName(1, bc, name)
+        for circle in circles:
+            circle.bc = bc
+        return bc
+
     def rotation(self, angle, origin, axis):
         """
         Methode to rotate the object Circle
@@ -237,15 +356,12 @@ class Circle:
         axis : tuple
             tuple of point (x,y,z) which represent the axis of rotation
         """
-        [
-            gmsh.model.occ.rotate(
-                [(self.dim, arccircle)],
-                *origin,
-                *axis,
-                angle,
-            )
-            for arccircle in self.arcCircle_list
-        ]
+        gmsh.model.occ.rotate(
+            [(self.dim, arccircle) for arccircle in self.arcCircle_list],
+            *origin,
+            *axis,
+            angle,
+        )
 
     def translation(self, vector):
         """
@@ -257,15 +373,15 @@ class Circle:
         direction : tuple
             tuple of point (x,y,z) which represent the direction of the translation
         """
-        [
-            gmsh.model.occ.translate([(self.dim, arccircle)], *vector)
-            for arccircle in self.arcCircle_list
-        ]
+        gmsh.model.occ.translate(
+            [(self.dim, arccircle) for arccircle in self.arcCircle_list], *vector
+        )
 
 
 class Rectangle:
     """
-    A class to represent a rectangle geometrical object, composed of 4 Lines object of gmsh
+    A class to represent a rectangle geometrical object, composed of the 4 boundary
+    curves of a gmsh rectangle
 
     ...
 
@@ -282,9 +398,15 @@ class Rectangle:
     dy: float
         length of the rectangle along the y direction
     mesh_size : float
-        attribute given for the class Point
+        If mesh_size is > 0, add a meshing constraint
+            at the 4 corners
     """
 
+    __slots__ = (
+        'xc', 'yc', 'z', 'dx', 'dy', 'mesh_size', 'dim', 'surface_tag', 'lines',
+        '_loop_tag', 'bc_in', 'bc_out', 'bc_wall_top', 'bc_wall_bottom', 'bc',
+    )
+
     def __init__(self, xc, yc, dx, dy, mesh_size):
 
         self.xc = xc
@@ -297,21 +419,46 @@ class Rectangle:
         self.mesh_size = mesh_size
         self.dim = 1
 
-        # Generate the 4 corners of the rectangle
-        self.points = [
-            Point(self.xc - self.dx / 2, self.yc - self.dy / 2, self.mesh_size),
-            Point(self.xc + self.dx / 2, self.yc - self.dy / 2, self.mesh_size),
-            Point(self.xc + self.dx / 2, self.yc + self.dy / 2, self.mesh_size),
-            Point(self.xc - self.dx / 2, self.yc + self.dy / 2, self.mesh_size),
-        ]
-
-        # Generate the 4 lines of the rectangle
-        self.lines = [
-            Line(self.points[0], self.points[1]),
-            Line(self.points[1], self.points[2]),
-            Line(self.points[2], self.points[3]),
-            Line(self.points[3], self.points[0]),
-        ]
+        # Generate the rectangle in one OCC primitive, only its boundary is kept
+        x0 = self.xc - self.dx / 2
+        y0 = self.yc - self.dy / 2
+        self.surface_tag = gmsh.model.occ.addRectangle(x0, y0, self.z, self.dx, self.dy)
+        # Boundary queried on the OCC side, the gmsh model is synchronized once at the end
+        curve_tags = [abs(tag) for tag in gmsh.model.occ.getCurveLoops(self.surface_tag)[1][0]]
+        if self.mesh_size > 0:
+            # OCC pads the vertex bounding boxes by ~1e-7, the search box must be larger
+            eps = max(1e-7 * max(self.dx, self.dy), 1e-6)
+            corners = []
+            for x in (x0, x0 + self.dx):
+                for y in (y0, y0 + self.dy):
+                    corners += gmsh.model.occ.getEntitiesInBoundingBox(
+                        x - eps, y - eps, self.z - eps, x + eps, y + eps, self.z + eps, dim=0
+                    )
+            if len(corners) != 4:
+                raise ValueError(
+                    "Rectangle corners not found, got {} points instead of 4".format(len(corners))
+                )
+            gmsh.model.occ.mesh.setSize(corners, self.mesh_size)
+        # The surface is built later with PlaneSurface (with the holes)
+        gmsh.model.occ.remove([(2, self.surface_tag)])
+
+        # Sort the 4 lines of the rectangle as bottom, right, top, left
+        # The wrap of the key is at -3pi/4 (a corner), far from any edge midpoint
+        centers = {
+            tag: gmsh.model.occ.getCenterOfMass(self.dim, tag)[:2] for tag in curve_tags
+        }
+
+        def angle_from_bottom(tag):
+            x, y = centers[tag]
+            return (np.arctan2(y - self.yc, x - self.xc) + 0.75 * np.pi) % (2 * np.pi)
+
+        sorted_tags = sorted(curve_tags, key=angle_from_bottom)
+        # Each line must lie on its side, define_bc relies on this order
+        (_, y_bot), (x_right, _), (_, y_top), (x_left, _) = [centers[tag] for tag in sorted_tags]
+        if not (y_bot < self.yc < y_top and x_left < self.xc < x_right):
+            raise ValueError("Rectangle lines are not ordered as bottom, right, top, left")
+        self.lines = [Curve(tag) for tag in sorted_tags]
+        self._loop_tag = None
 
     def close_loop(self):
         """
@@ -322,7 +469,10 @@ class Rectangle:
         _ : int
             return the tag of the CurveLoop object
         """
-        return CurveLoop(self.lines).tag
+        # The CurveLoop is only created once, even if used by several surfaces
+        if self._loop_tag is None:
+            self._loop_tag = CurveLoop(self.lines).tag
+        return self._loop_tag
 
     def define_bc(self):
         """
@@ -366,7 +516,12 @@ class Rectangle:
         axis : tuple
             tuple of point (x,y,z) which represent the axis of rotation
         """
-        [line.rotation(angle, origin, axis) for line in self.lines]
+        gmsh.model.occ.rotate(
+            [(line.dim, line.tag) for line in self.lines],
+            *origin,
+            *axis,
+            angle,
+        )
 
     def translation(self, vector):
         """
@@ -378,7 +533,7 @@ class Rectangle:
         direction : tuple
             tuple of point (x,y,z) which represent the direction of the translation
         """
-        [line.translation(vector) for line in self.lines]
+        gmsh.model.occ.translate([(line.dim, line.tag) for line in self.lines], *vector)
 
 class PlaneSurface:
     """
@@ -397,6 +552,8 @@ class PlaneSurface:
 
     """
 
+    __slots__ = ('geom_objects', 'tag_list', 'dim', 'tag', 'ps')
+
     def __init__(self, geom_objects):
 
         self.geom_objects = geom_objects
@@ -417,55 +574,122 @@ class PlaneSurface:
         gmsh.model.setPhysicalName(self.dim, self.ps, "fluid")
 
 def add_refinement_zone_rect(xc, yc, length, height, mesh_size_in, mesh_size_out, thickness):
-   field = gmsh.model.mesh.field.add("Box")
-   gmsh.model.mesh.field.setNumber(field, "VIn", mesh_size_in)
-   gmsh.model.mesh.field.setNumber(field, "VOut", mesh_size_out)
-   gmsh.model.mesh.field.setNumber(field, "XMin", xc - length/2)
-   gmsh.model.mesh.field.setNumber(field, "XMax", xc + length/2)
-   gmsh.model.mesh.field.setNumber(field, "YMin", yc - height/2)
-   gmsh.model.mesh.field.setNumber(field, "YMax", yc + height/2)
-   gmsh.model.mesh.field.setNumber(field, "Thickness", thickness)
-   gmsh.model.occ.synchronize()
+   add = gmsh.model.mesh.field.add
+   set_number = gmsh.model.mesh.field.setNumber
+   field = add("Box")
+   set_number(field, "VIn", mesh_size_in)
+   set_number(field, "VOut", mesh_size_out)
+   set_number(field, "XMin", xc - length/2)
+   set_number(field, "XMax", xc + length/2)
+   set_number(field, "YMin", yc - height/2)
+   set_number(field, "YMax", yc + height/2)
+   set_number(field, "Thickness", thickness)
    return field
 
-def custom_distance(xc, yc, dist_min, dist_max, mesh_size_in, mesh_size_out, global_mesh_size):
-   expr_field = gmsh.model.mesh.field.add("MathEval")
-   if xc >= 0 and yc >= 0:
-      expr = "((sqrt((x - {})^2 + (y - {})^2) - {})/{})^2*({}) + {}".format(xc, yc, dist_min, dist_max - dist_min, mesh_size_out - mesh_size_in, mesh_size_in)
-   elif xc < 0 and yc >= 0:
-      expr = "((sqrt((x + {})^2 + (y - {})^2) - {})/{})^2*({}) + {}".format(-xc, yc, dist_min, dist_max - dist_min, mesh_size_out - mesh_size_in, mesh_size_in)
-   elif xc < 0 and yc < 0:
-      expr = "((sqrt((x + {})^2 + (y + {})^2) - {})/{})^2*({}) + {}".format(-xc, -yc, dist_min, dist_max - dist_min, mesh_size_out - mesh_size_in, mesh_size_in)
-   elif xc >= 0 and yc < 0:
-      expr = "((sqrt((x - {})^2 + (y + {})^2) - {})/{})^2*({}) + {}".format(xc, -yc, dist_min, dist_max - dist_min, mesh_size_out - mesh_size_in, mesh_size_in)
-   # print(expr)
-   gmsh.model.mesh.field.setString(expr_field, "F",  expr)
-   field = gmsh.model.mesh.field.add("Threshold")
-   gmsh.model.mesh.field.setNumber(field, "DistMin",  mesh_size_out*0.998)
-   gmsh.model.mesh.field.setNumber(field, "DistMax", mesh_size_out*0.999)
-   gmsh.model.mesh.field.setNumber(field, "SizeMin", 0.)
-   gmsh.model.mesh.field.setNumber(field, "SizeMax", global_mesh_size)
-   gmsh.model.mesh.field.setNumber(field, "InField", expr_field)
-   field_max = gmsh.model.mesh.field.add("Max")
-   gmsh.model.mesh.field.setNumbers(field_max, "FieldsList", [expr_field, field])
-   gmsh.model.mesh.field.setAsBackgroundMesh(field_max)
-   return field_max
+def merge_refinement_zones(bounds):
+   """
+   Method to merge the boxes sharing the same y range and overlapping along x
+   ...
+
+   Parameters
+   ----------
+   bounds : np.ndarray
+      (N, 4) array, each row is [xmin, xmax, ymin, ymax] of a box
+
+   Returns
+   -------
+   merged : np.ndarray
+      (M, 4) array of the merged boxes, M <= N
+   """
+   merged = []
+   for xmin, xmax, ymin, ymax in sorted(bounds.tolist(), key=lambda box: (box[2], box[3], box[0])):
+      if merged and merged[-1][2:] == [ymin, ymax] and xmin <= merged[-1][1]:
+         merged[-1][1] = max(merged[-1][1], xmax)
+      else:
+         merged.append([xmin, xmax, ymin, ymax])
+   return np.array(merged, dtype=np.float64).reshape(-1, 4)
+
+def add_refinement_zones_batch(bounds, mesh_size_in, mesh_size_out, thickness):
+   """
+   Method to create one Box refinement field per row of bounds
+   ...
+
+   Parameters
+   ----------
+   bounds : np.ndarray
+      (N, 4) array, each row is [xmin, xmax, ymin, ymax] of a box
+   mesh_size_in : float
+      mesh size inside the boxes
+   mesh_size_out : float
+      mesh size outside the boxes
+   thickness : float
+      thickness of the transition layer outside the boxes
+
+   Returns
+   -------
+   fields : list(int)
+      tags of the Box fields
+   """
+   # The Box size only grows with the distance to the box, so the minimum over boxes
+   # forming a single rectangle is exactly the Box field of that rectangle
+   if mesh_size_in <= mesh_size_out:
+      bounds = merge_refinement_zones(bounds)
+   add = gmsh.model.mesh.field.add
+   set_number = gmsh.model.mesh.field.setNumber
+   fields = []
+   for xmin, xmax, ymin, ymax in bounds.tolist():
+      field = add("Box")
+      set_number(field, "VIn", mesh_size_in)
+      set_number(field, "VOut", mesh_size_out)
+      set_number(field, "XMin", xmin)
+      set_number(field, "XMax", xmax)
+      set_number(field, "YMin", ymin)
+      set_number(field, "YMax", ymax)
+      set_number(field, "Thickness", thickness)
+      fields.append(field)
+   return fields
+
+def custom_distance(xc, yc, dist_min, dist_max, mesh_size_in, mesh_size_out):
+   # Native Distance field to the center instead of a MathEval expression evaluated at every query
+   add = gmsh.model.mesh.field.add
+   set_number = gmsh.model.mesh.field.setNumber
+   set_numbers = gmsh.model.mesh.field.setNumbers
+   distance = add("Distance")
+   center = gmsh.model.occ.addPoint(xc, yc, 0)
+   set_numbers(distance, "PointsList", [center])
+   field = add("Threshold")
+   set_number(field, "DistMin",  dist_min)
+   set_number(field, "DistMax", dist_max)
+   # No size imposed outside of dist_max, the other fields take over
+   set_number(field, "StopAtDistMax", 1)
+   set_number(field, "SizeMin", mesh_size_in)
+   set_number(field, "SizeMax", mesh_size_out)
+   set_number(field, "InField", distance)
+   return field
 
 def sigmoid_transition(xc, yc, dist_min, dist_max, mesh_size_in, mesh_size_out):
-   distance = gmsh.model.mesh.field.add("Distance")
+   add = gmsh.model.mesh.field.add
+   set_number = gmsh.model.mesh.field.setNumber
+   set_numbers = gmsh.model.mesh.field.setNumbers
+   distance = add("Distance")
    center = gmsh.model.occ.addPoint(xc, yc, 0, mesh_size_in)
-   gmsh.model.mesh.field.setNumbers(distance, "PointsList", [center])
-   field = gmsh.model.mesh.field.add("Threshold")
-   gmsh.model.mesh.field.setNumber(field, "DistMin",  dist_min)
-   gmsh.model.mesh.field.setNumber(field, "DistMax", dist_max)
-   gmsh.model.mesh.field.setNumber(field, "StopAtDistMax", 1)
-   gmsh.model.mesh.field.setNumber(field, "Sigmoid", 1)
-   gmsh.model.mesh.field.setNumber(field, "SizeMin", mesh_size_in)
-   gmsh.model.mesh.field.setNumber(field, "SizeMax", mesh_size_out)
-   gmsh.model.mesh.field.setNumber(field, "InField", distance)
+   set_numbers(distance, "PointsList", [center])
+   field = add("Threshold")
+   set_number(field, "DistMin",  dist_min)
+   set_number(field, "DistMax", dist_max)
+   set_number(field, "StopAtDistMax", 1)
+   set_number(field, "Sigmoid", 1)
+   set_number(field, "SizeMin", mesh_size_in)
+   set_number(field, "SizeMax", mesh_size_out)
+   set_number(field, "InField", distance)
    return field
 
 def apply_fields(fields):
+   # No Min field to walk at every size query when there is nothing to combine
+   if len(fields) == 1:
+      gmsh.model.mesh.field.setAsBackgroundMesh(fields[0])
+      print("The final field is ", fields[0])
+      return
    field = gmsh.model.mesh.field.add("Min")
    gmsh.model.mesh.field.setNumbers(field, "FieldsList", fields)
    gmsh.model.mesh.field.setAsBackgroundMesh(field)
@@ -482,11 +706,15 @@ class Config:
       positions of the cylinders, the first one should be in (0, 0), you should not exceed 20*D for x (no negative x is recommanded) and 20*D for abs(y)
    path : str
       file for the export of the mesh
+   merge_cyl_bc : bool
+      if True, all the cylinders share a single "cyl" marker instead of "cyl0", "cyl1", ...
    """
-   def __init__(self, cyl_pos, path):
+   def __init__(self, cyl_pos, path, merge_cyl_bc=False):
       self.cyl_pos = cyl_pos
       self.path = path
+      self.merge_cyl_bc = merge_cyl_bc
 
+@dataclass(frozen=True, slots=True)
 class Params:
    """
    # Cylinder
@@ -504,16 +732,15 @@ class Params:
    LENGTH_REFINEMENT_DOWNSTREAM = 4*DIAMETER
    REFINED_MESH_SIZE = DIAMETER/12
    """
-   def __init__(self, diameter, n_points_cyl, height, length_upstream, length_downstream, global_mesh_size, length_refinement, length_refinement_downstream, refined_mesh_size):
-      self.diameter = diameter
-      self.n_points_cyl = n_points_cyl
-      self.height = height
-      self.length_upstream = length_upstream
-      self.length_downstream = length_downstream
-      self.global_mesh_size = global_mesh_size
-      self.length_refinement = length_refinement
-      self.length_refinement_downstream = length_refinement_downstream
-      self.refined_mesh_size = refined_mesh_size
+   diameter: float
+   n_points_cyl: int
+   height: float
+   length_upstream: float
+   length_downstream: float
+   global_mesh_size: float
+   length_refinement: float
+   length_refinement_downstream: float
+   refined_mesh_size: float
 
 class RunMeshConfig:
    """
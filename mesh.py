@@ -1,88 +1,199 @@
+from multiprocessing import Pool, Value
+import os
+from pathlib import Path
 import gmsh
-from geometry_def import (Circle, PlaneSurface, Rectangle, Point, add_refinement_zone_rect, apply_fields, custom_distance, Config, Params, RunMeshConfig, sigmoid_transition)
+import numpy as np
+from geometry_def import (Circle, PlaneSurface, Rectangle, Point, add_refinement_zones_batch, apply_fields, custom_distance, Config, Params, RunMeshConfig, sigmoid_transition)
 
-def mesh(cylinders_pos, out_path, params):
+def _available_cpus():
+   # CPUs this process may run on (can be fewer than os.cpu_count() in containers)
+   if hasattr(os, "sched_getaffinity"):
+      return sorted(os.sched_getaffinity(0))
+   return list(range(os.cpu_count() or 1))
+
+def init_gmsh(n_threads=None):
    """
-   Method to create a mesh with multiple cylinders with a fixed diameter
+   Method to start the gmsh session shared by all the meshes of a process
    ...
 
    Parameters
    ----------
-   cylinders_pos : [(x, y)]
-      Array of 2D position tuple, it is recommanded that the first cylinder is (0, 0)
-   out_path : str
-      File name and path to the mesh output
+   n_threads : int
+      Number of threads gmsh may use for meshing, all the available cores if None
    """
-
-   # Generate Geometry
+   if n_threads is None:
+      n_threads = len(_available_cpus())
    gmsh.initialize()
    gmsh.option.setNumber('General.Terminal', 0)
-   gmsh.clear()
+   # Only errors are logged, and only the physical groups are written
+   gmsh.option.setNumber('General.Verbosity', 1)
+   gmsh.option.setNumber('Mesh.SaveAll', 0)
+   gmsh.option.setNumber('General.NumThreads', n_threads)
+   gmsh.option.setNumber('Mesh.MaxNumThreads1D', n_threads)
+   gmsh.option.setNumber('Mesh.MaxNumThreads2D', n_threads)
+
+def _build_and_write(cylinders_pos, out_path, params, merge_cyl_bc=False):
+   """
+   Build and write one mesh in the already initialized gmsh session (see mesh for the parameters)
+   """
+
+   # Generate Geometry in its own model, removed once the mesh is written
+   gmsh.model.add(out_path)
+   gmsh.model.setCurrent(out_path)
+
+   # Parameters read once
+   diameter = params.diameter
+   n_points_cyl = params.n_points_cyl
+   height = params.height
+   length_upstream = params.length_upstream
+   length_downstream = params.length_downstream
+   global_mesh_size = params.global_mesh_size
+   length_refinement = params.length_refinement
+   length_refinement_downstream = params.length_refinement_downstream
+   refined_mesh_size = params.refined_mesh_size
 
    # External domain
-   total_length = params.length_upstream + params.length_downstream
-   xc = total_length/2 - params.length_upstream
-   ext_domain = Rectangle(xc, 0, total_length, params.height, mesh_size=params.global_mesh_size)
+   total_length = length_upstream + length_downstream
+   xc = total_length/2 - length_upstream
+   ext_domain = Rectangle(xc, 0, total_length, height, mesh_size=global_mesh_size)
 
    # Cylinders and refinement around them
-   circles = []
-   total_length = params.length_refinement + params.length_refinement_downstream
-   fields = []
-   for pos in cylinders_pos:
-      circles.append(Circle(pos[0], pos[1], params.diameter, params.n_points_cyl))
-      xc = total_length/2 - params.length_refinement + pos[0]
-      yc = pos[1]
-      # The fields need to be applied later
-      fields.append(add_refinement_zone_rect(xc, yc, total_length, params.length_refinement*2, params.refined_mesh_size, params.global_mesh_size, 40*params.diameter))
+   total_length = length_refinement + length_refinement_downstream
+   # Refinement boxes of all the cylinders: [xmin, xmax, ymin, ymax], only the position varies
+   centers = np.asarray(cylinders_pos, dtype=np.float64).reshape(-1, 2)
+   bounds = np.empty((len(centers), 4))
+   bounds[:, 0] = centers[:, 0] - length_refinement
+   bounds[:, 1] = bounds[:, 0] + total_length
+   bounds[:, 2] = centers[:, 1] - length_refinement
+   bounds[:, 3] = centers[:, 1] + length_refinement
+   # Same sizes and transition for every box: mesh_size_in, mesh_size_out, thickness
+   recipe = (refined_mesh_size, global_mesh_size, 40*diameter)
+   # The fields need to be applied later
+   fields = add_refinement_zones_batch(bounds, *recipe)
+   # Refinement around each cylinder, only depends on params
+   wall_mesh_size = diameter/n_points_cyl*1.02
+   const_dist = diameter/2.*1.1
+   dist_total = diameter/2.*2.
+   circles = Circle.add_many(centers, diameter, n_points_cyl)
+   for circle in circles:
       # 1.02 to prevent mesh size from being lower to actual edges along the cylinder due to curvature, it would double the number of edges
       # fields.append(add_refinement_zone_cyl(pos[0], pos[1], 1.2*params.diameter, params.diameter/params.n_points_cyl*1.02, params.global_mesh_size))
       #fields.append(threshold(circles[-1].xc, circles[-1].yc, 0., params.diameter/2.*2., params.diameter/params.n_points_cyl*1.02, params.refined_mesh_size))
-      const_dist = params.diameter/2.*1.1
-      dist_total = params.diameter/2.*2.
-      fields.append(custom_distance(circles[-1].xc, circles[-1].yc, params.diameter/2, const_dist, params.diameter/params.n_points_cyl*1.02, params.diameter/params.n_points_cyl*1.05, params.global_mesh_size))
       #fields.append(sigmoid_transition(circles[-1].xc, circles[-1].yc, const_dist*0.99, dist_total, params.diameter/params.n_points_cyl*1.05, params.refined_mesh_size))
-      fields.append(custom_distance(circles[-1].xc, circles[-1].yc, const_dist*0.99, dist_total, params.diameter/params.n_points_cyl*1.05, params.refined_mesh_size, params.global_mesh_size))
+      # Single Threshold: constant size along the cylinder up to const_dist, then transition to the refined size
+      fields.append(custom_distance(circle.xc, circle.yc, const_dist, dist_total, wall_mesh_size, refined_mesh_size))
       
-   gmsh.model.occ.synchronize()
+   # Remove the duplicated points generated by the arcCircle, once for all the cylinders
+   gmsh.model.occ.removeAllDuplicates()
 
    # Surface generation
    closed_loops = [ext_domain]
    for circle in circles:
       closed_loops.append(circle)
    surface_domain = PlaneSurface(closed_loops)
+   # Only synchronization needed: the physical groups and the mesh need the gmsh model
    gmsh.model.occ.synchronize()
 
    # BC definition
    ext_domain.define_bc()
-   for i, circle in enumerate(circles):
-      circle.define_bc('cyl'+str(i))
+   if merge_cyl_bc:
+      Circle.define_bc_batch(circles, 'cyl')
+   else:
+      for i, circle in enumerate(circles):
+         circle.define_bc('cyl'+str(i))
    surface_domain.define_bc()
-   gmsh.model.occ.synchronize()
       
    apply_fields(fields)
 
    # gmsh.option.setNumber("Mesh.Smoothing", 100)
 
+   # Frontal-Delaunay, no mesh size computed from the curvature
+   gmsh.option.setNumber("Mesh.Algorithm", 6)
+   gmsh.option.setNumber("Mesh.MeshSizeFromCurvature", 0)
+
    # Generate mesh
    gmsh.model.mesh.generate(2)
 
-   gmsh.model.mesh
+   # Binary MSH 4.1, faster to write than the ASCII default
+   gmsh.option.setNumber("Mesh.Binary", 1)
+   gmsh.option.setNumber("Mesh.MshFileVersion", 4.1)
 
-   # Output
-   gmsh.write(out_path)
+   # Output, written next to the final file then renamed so that no partially written mesh is left behind
+   root, ext = os.path.splitext(out_path)
+   tmp_path = root + ".part" + ext
+   try:
+      gmsh.write(tmp_path)
+   except Exception:
+      # No partial file left next to the output
+      if os.path.exists(tmp_path):
+         os.remove(tmp_path)
+      raise
+   os.replace(tmp_path, out_path)
+
+   # Release the model (geometry, fields and mesh) of this config
+   gmsh.model.remove()
 
    # Open user interface of GMSH
    # gmsh.fltk.run()
 
-   # Mesh file name and output
-   gmsh.finalize()
+def mesh(cylinders_pos, out_path, params, merge_cyl_bc=False):
+   """
+   Method to create a mesh with multiple cylinders with a fixed diameter
+   ...
+
+   Parameters
+   ----------
+   cylinders_pos : [(x, y)]
+      Array of 2D position tuple, it is recommanded that the first cylinder is (0, 0)
+   out_path : str
+      File name and path to the mesh output
+   params : Params
+      Dimensions and mesh sizes of the domain
+   merge_cyl_bc : bool
+      If True, all the cylinders share the single marker "cyl" instead of "cyl0", "cyl1", ...
+
+   Standalone version with its own gmsh session, run() reuses one session per worker instead
+   """
+   init_gmsh()
+   try:
+      _build_and_write(cylinders_pos, out_path, params, merge_cyl_bc)
+   finally:
+      gmsh.finalize()
+
+def _init_worker(next_rank, n_workers, n_threads):
+   # Pin each worker, and the meshing threads it starts later, to its own set of cores (Linux only)
+   # Ranks are handed out once from the shared counter, so no two workers get the same cores
+   with next_rank.get_lock():
+      rank = next_rank.value
+      next_rank.value += 1
+   # A worker replacing a dead one gets rank >= n_workers and is left unpinned
+   if hasattr(os, "sched_setaffinity") and rank < n_workers:
+      cpus = _available_cpus()[rank*n_threads:(rank + 1)*n_threads]
+      if cpus:
+         os.sched_setaffinity(0, cpus)
+   init_gmsh(n_threads)
+
+def _mesh_one(config_param):
+   print("-> Starting to mesh: " + config_param[0].path)
+   _build_and_write(config_param[0].cyl_pos, config_param[0].path, config_param[1], config_param[0].merge_cyl_bc)
+   print("-> Done meshing: " + config_param[0].path)
 
 def run(run_mesh_config: RunMeshConfig):
-   for config_param in run_mesh_config:
-      print("-> Starting to mesh: " + config_param[0].path)
-      mesh(config_param[0].cyl_pos, config_param[0].path, config_param[1])
-      print("-> Done meshing: " + config_param[0].path)
+   # Output directories created once upfront, gmsh.write would only fail after meshing
+   for out_dir in {Path(config_param[0].path).parent for config_param in run_mesh_config}:
+      out_dir.mkdir(parents=True, exist_ok=True)
+
+   # gmsh holds a global state, each config is meshed in its own process
+   # gmsh is initialized once per worker, the session ends with the worker process
+   # No more workers than configs, each extra worker would start gmsh for nothing
+   n_cpu = len(_available_cpus())
+   n_workers = max(1, min(len(run_mesh_config), n_cpu))
+   # The cores left by the workers are shared as meshing threads, without oversubscription
+   n_threads = max(1, n_cpu // n_workers)
+   next_rank = Value('i', 0)
+   with Pool(n_workers, initializer=_init_worker, initargs=(next_rank, n_workers, n_threads)) as pool:
+      pool.map(_mesh_one, run_mesh_config)
 
 if __name__ == "__main__":
    import run_mesh_config
-   run(run_mesh_config.to_run)
\ No newline at end of file
+   run(run_mesh_config.get_to_run())
\ No newline at end of file